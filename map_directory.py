@@ -4,54 +4,242 @@ import json
 import time
 import argparse
 import fnmatch
+import functools
 import ast
 import re
+import stat
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
 SUPPORTED_CODE_EXTENSIONS = {'.py', '.js', '.ts', '.java', '.c', '.cpp', '.h', '.cs', '.go', '.rb', '.php'}
 SUPPORTED_DOCS_EXTENSIONS = {'.md', '.txt'}
 SUPPORTED_CONFIG_EXTENSIONS = {'.json', '.yaml', '.yml', '.toml', '.xml'}
+OUTPUT_BUFFER_SIZE = 1 << 20
+CHARS_PER_TOKEN = 4
+SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+GLOB_CHARS = frozenset('*?[')
+NON_EXTENSION_CHARS = GLOB_CHARS | frozenset('./\\')
+PARSED_EXTENSIONS = {'.py'} | SUPPORTED_DOCS_EXTENSIONS
+CONTENT_SAMPLE_SIZE = 8192
+READ_FLAGS = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+READ_BATCH_SIZE = 16
+HEADER_RE = re.compile(r'^(#+)[ \t]+(.*)$', re.MULTILINE)
 
 class ProgressBar:
-    def __init__(self, total, description="", width=50):
-        self.total = max(total, 1)
+    SPINNER = '|/-\\'
+    REFRESH_INTERVAL = 0.05
+
+    def __init__(self, total=None, description="", width=50):
+        self.total = max(total, 1) if total is not None else None
         self.current = 0
         self.description = description
         self.width = width
         self.start_time = time.time()
+        self._last_flush = 0.0
+        self._frames = 0
+        # Redraws bypass sys.stdout's TextIOWrapper; flush it first so earlier prints stay in order.
+        sys.stdout.flush()
+        try:
+            self._fd = sys.stdout.fileno()
+        except (AttributeError, OSError, ValueError):
+            self._fd = None
+        self._encoding = getattr(sys.stdout, 'encoding', None) or 'utf-8'
+
+    @property
+    def description(self):
+        return self._description
+
+    @description.setter
+    def description(self, value):
+        self._description = value
+        self._prefix = f'\r{value:<25} ['
 
     def update(self, amount=1):
         self.current += amount
-        self._display()
+        now = time.monotonic()
+        if now - self._last_flush > self.REFRESH_INTERVAL or self.current == self.total:
+            self._last_flush = now
+            self._display()
+
+    def _write(self, text):
+        if self._fd is None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        else:
+            os.write(self._fd, text.encode(self._encoding, 'replace'))
 
     def _display(self):
+        self._frames += 1
+        if self.total is None:
+            spinner = self.SPINNER[self._frames % len(self.SPINNER)]
+            self._write(f'{self._prefix}{spinner}] {self.current} entries scanned')
+            return
         percent = min(100, (self.current / self.total) * 100)
         filled = int(self.width * self.current // self.total)
         bar = '█' * filled + '─' * (self.width - filled)
-        sys.stdout.write(f'\r{self.description:<25} [{bar}] {percent:.1f}%')
-        sys.stdout.flush()
+        self._write(f'{self._prefix}{bar}] {percent:.1f}%')
 
     def complete(self):
-        print()
+        if self.total is None:
+            self._display()
+        self._write('\n')
 
+@functools.lru_cache(maxsize=1024)
 def get_size_format(size_bytes):
     if size_bytes is None: return "N/A"
     if size_bytes == 0: return "0 B"
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.2f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.2f} PB"
-
-def estimate_tokens(text):
-    return len(text) // 4
+    unit = min((size_bytes.bit_length() - 1) // 10, len(SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (unit * 10)):.2f} {SIZE_UNITS[unit]}"
+
+class FileNode:
+    __slots__ = ('name', 'path', 'type', 'size', 'mtime', 'summary', 'children', 'target', 'skipped')
+
+    def __init__(self, name, path, type, mtime=None, size=None, summary=None, children=None, target=None, skipped=0):
+        self.name = name
+        self.path = path
+        self.type = type
+        self.mtime = mtime
+        self.size = size
+        self.summary = summary
+        self.children = children
+        self.target = target
+        # Entries ignored directly inside this directory, so cache hits can still count them.
+        self.skipped = skipped
+
+    def to_dict(self):
+        data = {"name": self.name, "path": self.path}
+        if self.mtime is not None:
+            data["mtime"] = self.mtime
+        data["type"] = self.type
+        if self.type == "directory":
+            if self.skipped:
+                data["skipped"] = self.skipped
+            data["children"] = self.children
+        elif self.type == "symlink":
+            data["target"] = self.target
+        else:
+            data["size"] = self.size
+            if self.summary is not None:
+                data["summary"] = self.summary
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        children = data.get("children")
+        if children is not None:
+            children = [cls.from_dict(child) for child in children]
+        return cls(data["name"], data["path"], data["type"], data.get("mtime"), data.get("size"), data.get("summary"), children, data.get("target"), data.get("skipped", 0))
+
+def _json_default(obj):
+    if isinstance(obj, FileNode):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dump_json(data, indent=False):
+    if orjson:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(data, default=_json_default, option=option)
+        except orjson.JSONEncodeError:
+            # orjson refuses documents nested deeper than its recursion limit.
+            pass
+    return json.dumps(data, indent=2 if indent else None, default=_json_default).encode('utf-8')
+
+def load_json(data):
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+def _encode_indented(value, pad):
+    return dump_json(value, indent=True).replace(b"\n", b"\n" + pad)
+
+def _iter_json_node(root, level):
+    # orjson has no incremental encoder, so directories are written by hand and only
+    # leaf nodes go through orjson. Memory stays bounded and deep trees never reach
+    # orjson's nesting limit.
+    stack = [(root, level)]
+    while stack:
+        item, level = stack.pop()
+        if isinstance(item, bytes):
+            yield item
+            continue
+        pad = b"  " * level
+        if item.type != "directory":
+            yield _encode_indented(item.to_dict(), pad)
+            continue
+        fields = item.to_dict()
+        children = fields.pop("children")
+        inner = pad + b"  "
+        head = b"{" + b"".join(b"\n" + inner + dump_json(key) + b": " + _encode_indented(value, inner) + b"," for key, value in fields.items())
+        if not children:
+            yield head + b"\n" + inner + b'"children": []\n' + pad + b"}"
+            continue
+        yield head + b"\n" + inner + b'"children": ['
+        stack.append((b"\n" + inner + b"]\n" + pad + b"}", None))
+        child_pad = b"\n" + inner + b"  "
+        for i in range(len(children) - 1, -1, -1):
+            stack.append((children[i], level + 2))
+            stack.append(((b"," if i else b"") + child_pad, None))
+
+def iter_json(data):
+    if not orjson:
+        for chunk in json.JSONEncoder(indent=2, default=_json_default).iterencode(data):
+            yield chunk.encode('utf-8')
+        return
+    separator = b"{"
+    for key, value in data.items():
+        yield separator + b"\n  " + dump_json(key) + b": "
+        if isinstance(value, FileNode):
+            yield from _iter_json_node(value, 1)
+        else:
+            yield _encode_indented(value, b"  ")
+        separator = b","
+    yield b"\n}" if data else b"{}"
+
+class OutputPruned(Exception):
+    pass
+
+class TokenBudgetWriter:
+    def __init__(self, out, max_tokens=None):
+        self.out = out
+        self.remaining = max_tokens * CHARS_PER_TOKEN if max_tokens else None
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.remaining is not None:
+            if len(data) > self.remaining:
+                cut = self.remaining
+                # Back up to a character boundary so the pruned file stays valid UTF-8.
+                while cut and (data[cut] & 0xC0) == 0x80:
+                    cut -= 1
+                self.out.write(data[:cut])
+                self.remaining = 0
+                raise OutputPruned()
+            self.remaining -= len(data)
+        self.out.write(data)
 
 def parse_python_file(content):
     summary = {"imports": [], "local_imports": [], "definitions": []}
     try:
         tree = ast.parse(content)
-        for node in ast.walk(tree):
+        for node in tree.body:
             if isinstance(node, ast.Import):
                 for alias in node.names:
                     summary["imports"].append(alias.name)
@@ -69,11 +257,11 @@ def parse_python_file(content):
     return summary
 
 def parse_markdown_file(content):
-    headers = re.findall(r'^(#+)\s+(.*)', content, re.MULTILINE)
+    headers = HEADER_RE.findall(content)
     return {"headers": [f"{'  ' * (len(h[0]) - 1)}- {h[1]}" for h in headers]}
 
-def get_intelligent_summary(file_path, content_lines):
-    ext = file_path.suffix.lower()
+def get_intelligent_summary(file_name, content_lines):
+    ext = os.path.splitext(file_name)[1].lower()
     content = "\n".join(content_lines)
     
     if ext == '.py':
@@ -83,153 +271,374 @@ def get_intelligent_summary(file_path, content_lines):
     
     return {"preview": content_lines[:5]}
 
+_gitignore_cache = {}
+
+def open_for_read(path):
+    try:
+        # O_NOATIME is only permitted on files we own; retry without it otherwise.
+        return os.open(path, READ_FLAGS | getattr(os, 'O_NOATIME', 0))
+    except PermissionError:
+        return os.open(path, READ_FLAGS)
+
+def decode_file_head(data, size=CONTENT_SAMPLE_SIZE):
+    if len(data) == size:
+        # Drop the trailing partial line so parsers only see whole lines.
+        data = data[:data.rfind(b'\n') + 1] or data
+    # Split the bytes: str.splitlines() also breaks on \x0c, \x85, U+2028 and friends.
+    return [line.decode('utf-8', 'ignore') for line in data.splitlines()]
+
+def open_file_budget():
+    if resource is None:
+        return 256
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return 1024
+    # Leave half the descriptor limit for stdio, the output file and the worker pools.
+    return max(1, min(1024, soft // 2))
+
+# Shared by every scanner thread; each held slot is one open descriptor.
+_fd_slots = threading.BoundedSemaphore(open_file_budget())
+
+def read_file_heads(paths, size=CONTENT_SAMPLE_SIZE):
+    # Open a batch of files and ask the kernel to start reading all of them
+    # (POSIX_FADV_WILLNEED) before the first read blocks, so cold reads overlap.
+    results = []
+    i = 0
+    while i < len(paths):
+        batch = []
+        while i < len(paths) and len(batch) < READ_BATCH_SIZE:
+            # Only wait for the first slot of a batch, so a thread never blocks while holding slots.
+            if not _fd_slots.acquire(blocking=not batch):
+                break
+            path = paths[i]
+            i += 1
+            try:
+                fd = open_for_read(path)
+            except OSError as e:
+                _fd_slots.release()
+                batch.append(e)
+                continue
+            if hasattr(os, 'posix_fadvise'):
+                try:
+                    os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+                except OSError:
+                    pass
+            batch.append(fd)
+        for fd in batch:
+            if isinstance(fd, OSError):
+                results.append(fd)
+                continue
+            try:
+                results.append(decode_file_head(os.read(fd, size), size))
+            except OSError as e:
+                results.append(e)
+            finally:
+                os.close(fd)
+                _fd_slots.release()
+    return results
+
 def load_gitignore_patterns(root_path):
-    patterns = []
-    current_path = root_path
     git_root = None
-
-    while current_path.parent != current_path:
-        if (current_path / ".git").is_dir():
-            git_root = current_path
+    for candidate in (root_path, *root_path.parents):
+        if (candidate / ".git").is_dir():
+            git_root = candidate
             break
-        current_path = current_path.parent
-    
-    if not git_root: return patterns
 
+    if not git_root: return []
+
+    cache_key = (root_path, git_root)
+    if cache_key in _gitignore_cache:
+        return _gitignore_cache[cache_key]
+
+    patterns = []
     search_path = git_root
-    while search_path != root_path.parent and search_path in root_path.parents:
-        gitignore_file = search_path / ".gitignore"
-        if gitignore_file.is_file():
-            try:
-                with open(gitignore_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        stripped = line.strip()
-                        if stripped and not stripped.startswith('#'):
-                            patterns.append(stripped)
-            except IOError:
-                pass
-        search_path = list(filter(lambda p: p.parent == search_path, root_path.parents))
-        if not search_path: break
-        search_path = search_path[0]
+    for part in ("", *root_path.relative_to(git_root).parts):
+        search_path = search_path / part
+        try:
+            with open(search_path / ".gitignore", 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except IOError:
+            continue
+        for line in lines:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('#'):
+                patterns.append(stripped)
 
+    _gitignore_cache[cache_key] = patterns
     return patterns
 
-def should_ignore(path, ignore_patterns):
-    for pattern in ignore_patterns:
-        if fnmatch.fnmatch(path.name, pattern) or fnmatch.fnmatch(str(path), pattern):
+def compile_globs(patterns):
+    # One alternation regex per bucket, so each name or path is matched in a single re call.
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns))
+
+class IgnoreMatcher:
+    def __init__(self, patterns):
+        self.literal_names = set()
+        self.ext_suffixes = set()
+        glob_patterns = []
+        negated_patterns = []
+        for pattern in patterns:
+            pattern = os.path.normcase(pattern)
+            if pattern.startswith('!'):
+                negated_patterns.append(pattern[1:])
+            elif not GLOB_CHARS.intersection(pattern):
+                self.literal_names.add(pattern)
+            elif pattern.startswith('*.') and not NON_EXTENSION_CHARS.intersection(pattern[2:]):
+                self.ext_suffixes.add(pattern[2:])
+            else:
+                glob_patterns.append(pattern)
+        self.glob_regex = compile_globs(glob_patterns)
+        self.negated_regex = compile_globs(negated_patterns)
+        self._name_cache = {}
+
+    def _matches_name(self, name):
+        if name in self.literal_names:
+            return True
+        _, dot, ext = name.rpartition('.')
+        if dot and ext in self.ext_suffixes:
             return True
-    return False
+        return self.glob_regex is not None and self.glob_regex.match(name) is not None
+
+    def should_ignore(self, name, path):
+        name = os.path.normcase(name)
+        path = os.path.normcase(path)
+        ignored = self._name_cache.get(name)
+        if ignored is None:
+            ignored = self._matches_name(name)
+            self._name_cache[name] = ignored
+        if not ignored:
+            ignored = path in self.literal_names or (self.glob_regex is not None and self.glob_regex.match(path) is not None)
+        if ignored and self.negated_regex is not None:
+            return not (self.negated_regex.match(name) or self.negated_regex.match(path))
+        return ignored
+
+class ScanCache:
+    def __init__(self, entries=None):
+        # Lookups read the loaded entries; only entries seen in this run are saved, so
+        # deleted files and the inodes left behind by atomic saves drop out.
+        self.loaded = entries or {}
+        self.seen = {}
+        self._keys_by_path = {entry["node"].path: key for key, entry in self.loaded.items()}
+
+    def get(self, key):
+        return self.loaded.get(key)
+
+    def keep(self, key, entry):
+        self.seen[key] = entry
+
+    def keep_subtree(self, node):
+        # A cache hit on a directory skips its subtree, so carry the subtree's entries over too.
+        pending = list(node.children or [])
+        while pending:
+            current = pending.pop()
+            key = self._keys_by_path.get(current.path)
+            if key is not None:
+                self.seen[key] = self.loaded[key]
+            if current.type == "directory":
+                pending.extend(current.children or [])
+
+def get_cache_key(entry_stat, path):
+    # DirEntry.stat() reports st_ino as 0 on Windows, so key those entries by path.
+    if entry_stat.st_ino:
+        return (entry_stat.st_dev, entry_stat.st_ino)
+    return path
+
+def accumulate_cached_stats(node, stats):
+    pending = [node]
+    while pending:
+        current = pending.pop()
+        if current.type == "directory":
+            stats["dirs"] += 1
+            stats["skipped"] += current.skipped
+            pending.extend(current.children or [])
+        elif current.type == "file":
+            stats["files"] += 1
+            stats["size"] += current.size or 0
+
+def scan_directory(parent_node, current_path, depth, args, ignore_matcher, cache, summary_pool):
+    stats = {"files": 0, "dirs": 0, "size": 0, "tokens": 0, "skipped": 0}
+    subdirs = []
+    summaries = []
+    to_read = []
+
+    if args.depth is not None and depth >= args.depth:
+        stats["skipped"] += 1
+        parent_node.skipped = 1
+        return stats, subdirs, summaries, 0
+
+    dir_entries = []
+    file_entries = []
+    try:
+        with _fd_slots, os.scandir(current_path) as it:
+            for entry in it:
+                (dir_entries if entry.is_dir(follow_symlinks=False) else file_entries).append(entry)
+    except (PermissionError, FileNotFoundError):
+        return stats, subdirs, summaries, 0
+    dir_entries.sort(key=lambda e: e.name.lower())
+    file_entries.sort(key=lambda e: e.name.lower())
+    entries = dir_entries + file_entries
+
+    for entry in entries:
+        entry_path = entry.path
+        if ignore_matcher.should_ignore(entry.name, entry_path):
+            stats["skipped"] += 1
+            continue
+
+        entry_stat = entry.stat(follow_symlinks=False)
+        link_target = None
+        if entry.is_symlink():
+            # A link to a regular file is reported as that file (its size and content);
+            # anything else (directories, broken links) is rendered as a link and not followed.
+            try:
+                target_stat = entry.stat()
+            except OSError:
+                target_stat = None
+            if target_stat is not None and stat.S_ISREG(target_stat.st_mode):
+                entry_stat = target_stat
+            else:
+                try:
+                    link_target = os.readlink(entry_path)
+                except OSError:
+                    link_target = "?"
+        mod_time = entry_stat.st_mtime
+        cache_key = get_cache_key(entry_stat, entry_path)
+        cached = cache.get(cache_key) if args.use_cache else None
+        # Inodes survive renames: a moved file keeps its summary under its new name, but a
+        # moved directory's cached subtree carries stale paths, so it is rescanned.
+        if cached and cached["mtime"] == entry_stat.st_mtime_ns and (cached["node"].type == "file" or cached["node"].path == entry_path):
+            file_node = cached["node"]
+            if file_node.path != entry_path:
+                file_node = FileNode(entry.name, entry_path, file_node.type, file_node.mtime, file_node.size, file_node.summary)
+            accumulate_cached_stats(file_node, stats)
+            if file_node.type == "directory":
+                cache.keep_subtree(file_node)
+        else:
+            if link_target is not None:
+                file_node = FileNode(entry.name, entry_path, "symlink", mod_time, target=link_target)
+            elif entry.is_dir(follow_symlinks=False):
+                file_node = FileNode(entry.name, entry_path, "directory", mod_time, children=[])
+                stats["dirs"] += 1
+                subdirs.append((file_node, entry_path, depth + 1))
+            else:
+                size = entry_stat.st_size
+                file_node = FileNode(entry.name, entry_path, "file", mod_time, size)
+                stats["files"] += 1
+                stats["size"] += size
+
+                if args.no_content:
+                    file_node.summary = "Content omitted by user."
+                else:
+                    to_read.append(file_node)
+
+        if args.use_cache:
+            cache.keep(cache_key, {"mtime": entry_stat.st_mtime_ns, "node": file_node})
+
+        parent_node.children.append(file_node)
+
+    parent_node.skipped = stats["skipped"]
+    heads = read_file_heads([file_node.path for file_node in to_read])
+    for file_node, content_lines in zip(to_read, heads):
+        try:
+            if isinstance(content_lines, OSError):
+                raise content_lines
+            ext = os.path.splitext(file_node.name)[1].lower()
+            if summary_pool and ext in PARSED_EXTENSIONS:
+                summaries.append((file_node, summary_pool.submit(get_intelligent_summary, file_node.name, content_lines)))
+            else:
+                file_node.summary = get_intelligent_summary(file_node.name, content_lines)
+        except Exception:
+            file_node.summary = {"error": "Could not read or parse file."}
+
+    return stats, subdirs, summaries, len(entries)
+
+def create_summary_pool():
+    # On a single CPU, pickling snippets to a worker costs more than parsing them here.
+    if (os.cpu_count() or 1) <= 1:
+        return None
+    try:
+        # Forking after the scanner threads start is unsafe, so workers are spawned.
+        # max_workers=None lets the executor apply the platform cap (61 on Windows).
+        return ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+    except (NotImplementedError, OSError, ValueError, TypeError):
+        # TypeError: Python 3.6 has no mp_context argument; summaries are then parsed in-thread.
+        return None
 
 def map_directory(root_path, args, cache):
     base_ignore = {".git", ".vscode", "__pycache__", "node_modules", "venv"}
     gitignore_patterns = load_gitignore_patterns(root_path) if args.use_gitignore else []
-    ignore_patterns = set(args.ignore or []) | base_ignore | set(gitignore_patterns)
+    ignore_matcher = IgnoreMatcher(set(args.ignore or []) | base_ignore | set(gitignore_patterns))
 
-    tree = {"name": root_path.name, "path": str(root_path), "type": "directory", "children": []}
+    tree = FileNode(root_path.name, str(root_path), "directory", children=[])
     stats = {"files": 0, "dirs": 0, "size": 0, "tokens": 0, "skipped": 0}
-    
-    paths_to_process = []
-    for dirpath, dirnames, filenames in os.walk(root_path, topdown=True):
-        original_dirs = dirnames[:]
-        dirnames[:] = [d for d in original_dirs if not should_ignore(Path(d), ignore_patterns)]
-        stats["skipped"] += len(original_dirs) - len(dirnames)
-        
-        current_depth = Path(dirpath).relative_to(root_path).parts
-        if args.depth is not None and len(current_depth) >= args.depth:
-            stats["skipped"] += len(dirnames)
-            dirnames[:] = []
-        
-        paths_to_process.extend([Path(dirpath, name) for name in dirnames])
-        paths_to_process.extend([Path(dirpath, name) for name in filenames])
-
-    progress = ProgressBar(len(paths_to_process), "Mapping directory")
-
-    node_stack = [(tree, root_path, 0)]
-    
-    while node_stack:
-        parent_node, current_path, depth = node_stack.pop()
-        
-        if args.depth is not None and depth >= args.depth:
-            continue
-            
-        try:
-            entries = sorted(os.scandir(current_path), key=lambda e: (e.is_file(), e.name.lower()))
-        except (PermissionError, FileNotFoundError):
-            continue
 
-        for entry in entries:
-            progress.update()
-            entry_path = Path(entry.path)
-            if should_ignore(entry_path, ignore_patterns):
-                stats["skipped"] += 1
-                continue
+    progress = ProgressBar(description="Mapping directory")
+    # ast.parse and the header regex hold the GIL, so parsing goes to worker processes.
+    summary_pool = None if args.no_content else create_summary_pool()
+    pending_summaries = []
+
+    # scandir/stat/open release the GIL, so directories are scanned on a thread pool.
+    # Each task only appends to its own directory node; stats and progress are merged here.
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {executor.submit(scan_directory, tree, str(root_path), 0, args, ignore_matcher, cache, summary_pool)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_stats, subdirs, summaries, scanned = future.result()
+                    for key, value in dir_stats.items():
+                        stats[key] += value
+                    for dir_node, dir_path, depth in subdirs:
+                        pending.add(executor.submit(scan_directory, dir_node, dir_path, depth, args, ignore_matcher, cache, summary_pool))
+                    pending_summaries.extend(summaries)
+                    progress.description = f"{stats['files']} files / {stats['dirs']} dirs"
+                    progress.update(scanned)
+
+        for file_node, future in pending_summaries:
+            try:
+                file_node.summary = future.result()
+            except Exception:
+                file_node.summary = {"error": "Could not read or parse file."}
+    finally:
+        if summary_pool:
+            summary_pool.shutdown()
 
-            mod_time = entry.stat().st_mtime
-            if args.use_cache and str(entry_path) in cache and cache[str(entry_path)]["mtime"] == mod_time:
-                file_node = cache[str(entry_path)]["node"]
-            else:
-                file_node = {
-                    "name": entry.name,
-                    "path": str(entry_path),
-                    "mtime": mod_time
-                }
-                if entry.is_dir():
-                    file_node.update({"type": "directory", "children": []})
-                    stats["dirs"] += 1
-                    node_stack.append((file_node, entry_path, depth + 1))
-                else:
-                    size = entry.stat().st_size
-                    file_node.update({"type": "file", "size": size})
-                    stats["files"] += 1
-                    stats["size"] += size
-                    
-                    if args.no_content:
-                        file_node["summary"] = "Content omitted by user."
-                    else:
-                        try:
-                            with open(entry_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                content_lines = f.readlines(8192)
-                            summary = get_intelligent_summary(entry_path, content_lines)
-                            file_node["summary"] = summary
-                        except Exception:
-                            file_node["summary"] = {"error": "Could not read or parse file."}
-            
-            if args.use_cache:
-                cache[str(entry_path)] = {"mtime": mod_time, "node": file_node}
-
-            parent_node["children"].append(file_node)
-    
     progress.complete()
     return tree, stats
 
-def generate_text_output(node, prefix="", is_last=True):
-    lines = []
-    connector = "└── " if is_last else "├── "
-    line = f"{prefix}{connector}{node['name']}"
-    
-    if node['type'] == 'directory':
-        lines.append(line + "/")
-        extension = "    " if is_last else "│   "
-        new_prefix = prefix + extension
-        for i, child in enumerate(node.get('children', [])):
-            lines.extend(generate_text_output(child, new_prefix, i == len(node['children']) - 1))
-    else:
-        size_str = get_size_format(node.get('size'))
-        line += f" ({size_str})"
-        lines.append(line)
-        summary = node.get('summary', {})
+def emit_tree(root, out):
+    stack = [(root, "", True)]
+    while stack:
+        node, prefix, is_last = stack.pop()
+        connector = "└── " if is_last else "├── "
+
+        if node.type == 'directory':
+            out.write(f"{prefix}{connector}{node.name}/\n")
+            # One prefix string per directory, shared by all of its children.
+            child_prefix = prefix + ("    " if is_last else "│   ")
+            children = node.children
+            last = len(children) - 1
+            for i in range(last, -1, -1):
+                stack.append((children[i], child_prefix, i == last))
+            continue
+        if node.type == 'symlink':
+            out.write(f"{prefix}{connector}{node.name} -> {node.target}\n")
+            continue
+
+        out.write(f"{prefix}{connector}{node.name} ({get_size_format(node.size)})\n")
+        summary = node.summary
         if summary:
-            summary_prefix = prefix + ("    " if is_last else "│   ")
+            child_prefix = prefix + ("    " if is_last else "│   ")
             if 'error' in summary:
-                 lines.append(f"{summary_prefix}  [!] {summary['error']}")
+                out.write(f"{child_prefix}  [!] {summary['error']}\n")
             if 'headers' in summary:
-                for header in summary['headers'][:3]: lines.append(f"{summary_prefix}  - {header}")
+                for header in summary['headers'][:3]: out.write(f"{child_prefix}  - {header}\n")
             if 'definitions' in summary:
-                for definition in summary['definitions'][:3]: lines.append(f"{summary_prefix}  > {definition}")
+                for definition in summary['definitions'][:3]: out.write(f"{child_prefix}  > {definition}\n")
             if 'local_imports' in summary and summary['local_imports']:
-                lines.append(f"{summary_prefix}  Imports: {', '.join(summary['local_imports'])}")
-
-    return lines
+                out.write(f"{child_prefix}  Imports: {', '.join(summary['local_imports'])}\n")
 
 def detect_project_type(root_path):
     if any(root_path.glob('*.sln')) or any(root_path.glob('*.csproj')):
@@ -275,69 +684,87 @@ def main():
         print(f"\n[ERROR] Directory '{root_path}' does not exist.")
         return
 
-    cache = {}
+    cache_entries = {}
     if args.clear_cache and cache_file.exists():
         print("[INFO] Clearing cache.")
         os.remove(cache_file)
     if args.use_cache and cache_file.exists():
         print("[INFO] Loading cache from:", cache_file)
-        with open(cache_file, 'r') as f:
-            cache = json.load(f)
+        with open(cache_file, 'rb') as f:
+            data = f.read()
+        try:
+            for key, entry in load_json(data).items():
+                dev, _, ino = key.partition(",")
+                if dev.isdigit() and ino.isdigit():
+                    key = (int(dev), int(ino))
+                cache_entries[key] = {"mtime": entry["mtime"], "node": FileNode.from_dict(entry["node"])}
+        except ValueError:
+            print("[WARN] Cache file is corrupt; rebuilding it.")
+            cache_entries = {}
+    cache = ScanCache(cache_entries)
 
     start_time = time.time()
     tree, stats = map_directory(root_path, args, cache)
     project_type = detect_project_type(root_path)
     
-    output_content = ""
-    if args.format == 'json':
-        json_data = {"project_type": project_type, "stats": stats, "tree": tree}
-        output_content = json.dumps(json_data, indent=2)
-    else:
-        header = [
-            f"{'='*80}",
-            f" Directory Map for: {root_path}",
-            f" Project Type: {project_type}",
-            f" Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-            f"{'='*80}",
-            f" Summary: {stats['files']} files, {stats['dirs']} directories | Total Size: {get_size_format(stats['size'])} | Skipped: {stats['skipped']}",
-            f"{'-'*80}\n"
-        ]
-        tree_lines = generate_text_output(tree)
-        output_content = "\n".join(header + tree_lines)
-
-    if args.max_tokens:
-        estimated_tokens = estimate_tokens(output_content)
-        if estimated_tokens > args.max_tokens:
-            print(f"[WARN] Output ({estimated_tokens} tokens) exceeds budget ({args.max_tokens}). Pruning...")
-            scale = args.max_tokens / estimated_tokens
-            output_content = output_content[:int(len(output_content) * scale)]
-            output_content += "\n\n[... OUPUT PRUNED TO FIT TOKEN BUDGET ...]"
-
     try:
-        with open(args.output, 'w', encoding='utf-8') as f:
-            f.write(output_content)
+        with open(args.output, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+            out = TokenBudgetWriter(f, args.max_tokens)
+            try:
+                if args.format == 'json':
+                    json_data = {"project_type": project_type, "stats": stats, "tree": tree}
+                    for chunk in iter_json(json_data):
+                        out.write(chunk)
+                else:
+                    header = [
+                        f"{'='*80}",
+                        f" Directory Map for: {root_path}",
+                        f" Project Type: {project_type}",
+                        f" Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                        f"{'='*80}",
+                        f" Summary: {stats['files']} files, {stats['dirs']} directories | Total Size: {get_size_format(stats['size'])} | Skipped: {stats['skipped']}",
+                        f"{'-'*80}\n"
+                    ]
+                    out.write("\n".join(header) + "\n")
+                    emit_tree(tree, out)
+            except OutputPruned:
+                print(f"[WARN] Output exceeds budget ({args.max_tokens} tokens). Pruning...")
+                f.write(b"\n\n[... OUPUT PRUNED TO FIT TOKEN BUDGET ...]")
         print(f"\n[SUCCESS] Map saved to '{args.output}'")
     except IOError as e:
         print(f"\n[ERROR] Could not write to file: {e}")
 
     if args.use_cache:
+        # Serialize before touching the file and swap it in whole, so a failed save
+        # leaves the previous cache intact instead of a truncated one.
+        temp_file = cache_file.with_name(cache_file.name + ".tmp")
         try:
-            with open(cache_file, 'w') as f:
-                json.dump(cache, f)
+            data = dump_json({f"{key[0]},{key[1]}" if isinstance(key, tuple) else key: entry for key, entry in cache.seen.items()})
+            with open(temp_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as f:
+                f.write(data)
+            os.replace(temp_file, cache_file)
             print(f"[INFO] Cache updated at '{cache_file}'")
-        except IOError:
+        except (IOError, ValueError, RecursionError):
             print("[WARN] Could not save cache file.")
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
 
     end_time = time.time()
-    print("\n" + "="*80)
-    print(" " * 32 + "TASK COMPLETE")
-    print("="*80)
-    print(f"  - Project Type: {project_type}")
-    print(f"  - Time Taken:   {end_time - start_time:.2f} seconds")
-    print(f"  - Output Format:  {args.format.upper()}")
-    print(f"  - Total Size:     {get_size_format(stats['size'])}")
-    print(f"  - Final Output:   {args.output}")
-    print("="*80 + "\n")
+    report = [
+        "\n" + "="*80,
+        " " * 32 + "TASK COMPLETE",
+        "="*80,
+        f"  - Project Type: {project_type}",
+        f"  - Time Taken:   {end_time - start_time:.2f} seconds",
+        f"  - Output Format:  {args.format.upper()}",
+        f"  - Total Size:     {get_size_format(stats['size'])}",
+        f"  - Final Output:   {args.output}",
+        "="*80 + "\n",
+    ]
+    sys.stdout.write("\n".join(report) + "\n")
+    sys.stdout.flush()
 
 
 if __name__ == "__main__":